@@ -1,23 +1,35 @@
 import os
 import io
+import asyncio
+import threading
 import logging
 import queue
-import json
+import collections
 import time
-import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Callable
 from dotenv import load_dotenv
 
 # Load environment variables from .env.local
 load_dotenv()
 
+import httpx
+import orjson
 import streamlit as st
-from openai import AzureOpenAI
 from streamlit import session_state as ss
-from PIL import Image
 
 # Constants
 AZURE_DEPLOYMENT_NAME_FALLBACK = "gpt-4o"  # Default deployment name
 AZURE_ASSISTANT_ID_FALLBACK = "assistant_id_fallback"
+AZURE_API_VERSION = "2024-05-01-preview"
+AZURE_BATCH_API_VERSION = "2024-10-21"  # Batch API requires a newer API version
+BATCH_STOPPED_STATUSES = ("completed", "failed", "expired", "cancelling", "cancelled")
+UPLOAD_MAX_WORKERS = 8  # Concurrent file uploads
+DOWNLOAD_MAX_WORKERS = 8  # Concurrent file downloads
+
+# Shared HTTP settings for the sync and async clients; HTTP/2 reuses warm connections
+HTTP_TIMEOUT = httpx.Timeout(600.0, connect=10.0)  # Keep the SDK's long read timeout for streamed runs
 
 # Configure page
 st.set_page_config(page_title="Data Analysis Assistant", page_icon="📊", layout="centered")
@@ -37,14 +49,23 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_resource(show_spinner=False)
 def init_logging():
-    logging.basicConfig(format="[%(asctime)s] %(levelname)+8s: %(message)s")
     local_logger = logging.getLogger()
-    local_logger.setLevel(logging.INFO)
+    # The root logger outlives script reruns, so configure it only once
+    if not local_logger.handlers:
+        logging.basicConfig(format="[%(asctime)s] %(levelname)+8s: %(message)s")
+        local_logger.setLevel(logging.INFO)
     return local_logger
 logger = init_logging()
 
+def warm_up_client(azure_client):
+    """Issue a cheap request so the connection pool is ready before the first upload"""
+    try:
+        next(iter(azure_client.with_options(timeout=5.0).models.list().data), None)
+        logger.info("Warmed up Azure OpenAI connection")
+    except Exception as e:
+        logger.info(f"Skipped Azure OpenAI warm-up: {e}")
+
 @st.cache_resource(show_spinner=False)
 def create_assistants_client():
     logger.info("Creating Azure OpenAI client")
@@ -63,23 +84,99 @@ def create_assistants_client():
     logger.info(f"Using Azure OpenAI endpoint: {endpoint}")
     
     try:
+        from openai import AzureOpenAI, DefaultHttpxClient
         azure_client = AzureOpenAI(
             api_key=api_key,
             azure_endpoint=endpoint,
-            api_version="2024-05-01-preview",
+            api_version=AZURE_API_VERSION,
+            http_client=DefaultHttpxClient(http2=True, timeout=HTTP_TIMEOUT),
         )
+        threading.Thread(target=warm_up_client, args=(azure_client,), daemon=True).start()
         return azure_client
     except Exception as e:
         st.error(f"Error creating Azure OpenAI client: {e}")
         logger.error(f"Error creating Azure OpenAI client: {e}")
         st.stop()
 
+@st.cache_resource(show_spinner=False)
+def create_async_assistants_client():
+    logger.info("Creating async Azure OpenAI client")
+    from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+    return AsyncAzureOpenAI(
+        api_key=os.environ.get("AZURE_OPENAI_API_KEY"),
+        azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
+        api_version=AZURE_API_VERSION,
+        http_client=DefaultAsyncHttpxClient(http2=True, timeout=HTTP_TIMEOUT),
+    )
+
+@st.cache_resource(show_spinner=False)
+def create_event_loop():
+    """Run a shared event loop in a background thread for the async client"""
+    logger.info("Starting background event loop")
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+@st.cache_resource(show_spinner=False)
+def create_image_pool():
+    """Thread pool for fetching assistant-generated images off the streaming path"""
+    return ThreadPoolExecutor(max_workers=4)
+
+@st.cache_resource(show_spinner=False)
+def get_or_create_assistant():
+    """Retrieve the configured assistant, creating one if it does not exist"""
+    try:
+        # Try to retrieve existing assistant
+        assistant_id = os.environ.get("AZURE_ASSISTANT_ID", AZURE_ASSISTANT_ID_FALLBACK)
+        assistant = client.beta.assistants.retrieve(assistant_id=assistant_id)
+        logger.info(f"Located assistant: {assistant.name}")
+    except Exception as e:
+        logger.info(f"Creating new assistant: {e}")
+        # Create a new assistant if not found
+        deployment_name = os.environ.get("AZURE_DEPLOYMENT_NAME", AZURE_DEPLOYMENT_NAME_FALLBACK)
+        assistant = client.beta.assistants.create(
+            name="Data Analysis Assistant",
+            instructions="""You are a data analysis assistant. Your job is to help analyze datasets and answer questions about them.
+            When analyzing data:
+            1. First, explore and understand the dataset structure
+            2. Clean and preprocess the data as needed
+            3. Perform the requested analysis
+            4. Create visualizations when appropriate
+            5. Explain your findings in clear, non-technical language
+
+            Always be concise and focus on the most important insights.
+            """,
+            tools=[
+                {"type": "code_interpreter"},
+                {"type": "function", "function": {
+                    "name": "analyze_data",
+                    "description": "Analyze a dataset based on a specific question",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "dataset_name": {"type": "string"},
+                            "question": {"type": "string"}
+                        },
+                        "required": ["dataset_name", "question"]
+                    }
+                }}
+            ],
+            model=deployment_name
+        )
+        logger.info(f"Created new assistant: {assistant.id}")
+    return assistant
+
 # Initialize client
 client = create_assistants_client()
+async_client = create_async_assistants_client()
+event_loop = create_event_loop()
+image_pool = create_image_pool()
+batch_client = client.with_options(api_version=AZURE_BATCH_API_VERSION)
+assistant = get_or_create_assistant()
 
 # Initialize session state
 if 'tool_requests' not in ss:
-    ss['tool_requests'] = queue.Queue()
+    ss['tool_requests'] = collections.deque()
 tool_requests = ss['tool_requests']
 
 if "file_uploaded" not in ss:
@@ -95,47 +192,68 @@ if "file_ids" not in ss:
     ss.file_ids = []
 
 if "assistant_created_file_ids" not in ss:
-    ss.assistant_created_file_ids = []
+    ss.assistant_created_file_ids = {}  # Ordered set of file IDs
+
+if "batch_id" not in ss:
+    ss.batch_id = None
 
 # Helper functions
+def upload_file(file):
+    """Upload a file to OpenAI for use by the assistant"""
+    return client.files.create(
+        file=file,
+        purpose='assistants'
+    )
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=1024)
+def get_moderation_flag(text: str) -> bool:
+    """Query the moderation endpoint, cached per text; errors are not cached"""
+    response = client.moderations.create(input=text)
+    return response.results[0].flagged
+
 def moderation_endpoint(text):
     """Check if text is flagged by the moderation endpoint"""
     try:
-        response = client.moderations.create(input=text)
-        return response.results[0].flagged
+        return get_moderation_flag(text)
     except Exception as e:
         logger.error(f"Error checking moderation: {e}")
         return False
 
-def delete_files(file_id_list):
-    """Delete files from OpenAI"""
-    for file_id in file_id_list:
-        try:
-            client.files.delete(file_id)
-            logger.info(f"Deleted file: {file_id}")
-        except Exception as e:
-            logger.error(f"Error deleting file {file_id}: {e}")
-
-def delete_thread(thread_id):
-    """Delete a thread"""
+async def delete_resource(delete, resource_type, resource_id):
+    """Delete a thread or file, logging failures so other deletes keep running"""
     try:
-        client.beta.threads.delete(thread_id)
-        logger.info(f"Deleted thread: {thread_id}")
+        await delete(resource_id)
+        logger.info(f"Deleted {resource_type}: {resource_id}")
     except Exception as e:
-        logger.error(f"Error deleting thread {thread_id}: {e}")
+        logger.error(f"Error deleting {resource_type} {resource_id}: {e}")
 
-def retrieve_assistant_created_files(thread_id):
-    """Retrieve files created by the assistant in a thread"""
-    assistant_created_file_ids = []
-    try:
-        messages = client.beta.threads.messages.list(thread_id=thread_id)
-        for message in messages.data:
-            if message.role == "assistant":
-                for attachment in message.attachments:
-                    assistant_created_file_ids.append(attachment.file_id)
-    except Exception as e:
-        logger.error(f"Error retrieving assistant files: {e}")
-    return assistant_created_file_ids
+async def delete_resources(thread_id, file_id_list):
+    """Delete a thread and files concurrently"""
+    deletes = [delete_resource(async_client.files.delete, "file", file_id) for file_id in file_id_list]
+    if thread_id:
+        deletes.append(delete_resource(async_client.beta.threads.delete, "thread", thread_id))
+    await asyncio.gather(*deletes)
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=64)
+def get_file_content(file_id):
+    """Download the content of a file in chunks, cached across reruns"""
+    buffer = io.BytesIO()
+    with client.files.with_streaming_response.content(file_id) as response:
+        for chunk in response.iter_bytes():
+            buffer.write(chunk)
+    return buffer.getvalue()
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=1024)
+def get_file_name(file_id):
+    """Retrieve the name of a file, cached across reruns"""
+    return client.files.retrieve(file_id).filename
+
+def fetch_file(file_id):
+    """Fetch the content and name of a file concurrently"""
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        content_future = executor.submit(get_file_content, file_id)
+        name_future = executor.submit(get_file_name, file_id)
+        return content_future.result(), name_future.result()
 
 def render_download_files(file_id_list):
     """Render download buttons for files and return file data"""
@@ -144,11 +262,12 @@ def render_download_files(file_id_list):
     
     if len(file_id_list) > 0:
         st.markdown("### 📂 Generated Files")
-        for file_id in file_id_list:
+        # Fetch files in the background; Streamlit calls stay on the main thread
+        with ThreadPoolExecutor(max_workers=min(DOWNLOAD_MAX_WORKERS, len(file_id_list))) as executor:
+            futures = [executor.submit(fetch_file, file_id) for file_id in file_id_list]
+        for file_id, future in zip(file_id_list, futures):
             try:
-                file_data = client.files.content(file_id)
-                file = file_data.read()
-                file_name = client.files.retrieve(file_id).filename
+                file, file_name = future.result()
                 
                 # Store the downloaded file and its name
                 downloaded_files.append(file)
@@ -171,9 +290,145 @@ def analyze_data(dataset_name: str, question: str) -> str:
     """
     Analyze the provided dataset based on the question
     """
-    time.sleep(2)  # Simulate processing time
+    if os.environ.get("SIMULATE_LATENCY"):
+        time.sleep(2)  # Simulate processing time
     return f"Analysis of {dataset_name} complete. The answer to '{question}' is in the generated visualizations and data."
 
+# Tool functions the assistant may call, keyed by function name
+TOOL_HANDLERS: dict[str, Callable[..., str]] = {
+    "analyze_data": analyze_data,
+}
+
+# Batch functions
+def batch_analyze_data(requests):
+    """
+    Submit analysis requests to the Batch API for offline processing.
+    Each request is a dict with a custom_id, a question and an optional dataset_name.
+    """
+    deployment_name = os.environ.get(
+        "AZURE_BATCH_DEPLOYMENT_NAME",
+        os.environ.get("AZURE_DEPLOYMENT_NAME", AZURE_DEPLOYMENT_NAME_FALLBACK)
+    )
+    lines = []
+    for request in requests:
+        question = request["question"]
+        if request.get("dataset_name"):
+            question = f"Dataset: {request['dataset_name']}\nQuestion: {question}"
+        lines.append(orjson.dumps({
+            "custom_id": request["custom_id"],
+            "method": "POST",
+            "url": "/chat/completions",
+            "body": {
+                "model": deployment_name,
+                "messages": [
+                    {"role": "system", "content": "You are a data analysis assistant. Answer concisely in clear, non-technical language."},
+                    {"role": "user", "content": question}
+                ]
+            }
+        }))
+    
+    batch_file = batch_client.files.create(
+        file=("batch_requests.jsonl", b"\n".join(lines)),
+        purpose="batch"
+    )
+    batch = batch_client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/chat/completions",
+        completion_window="24h"
+    )
+    logger.info(f"Created batch: {batch.id} with {len(lines)} request(s)")
+    return batch
+
+def retrieve_batch_results(batch_id):
+    """Return the batch and its answers or errors keyed by custom_id"""
+    batch = batch_client.batches.retrieve(batch_id)
+    results = {}
+    # Successful requests are written to the output file and failed ones to the error file
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        output = batch_client.files.content(file_id).read()
+        for line in output.splitlines():
+            if not line:
+                continue
+            result = orjson.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") == 200:
+                results[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+            else:
+                results[result["custom_id"]] = f"[Request failed: {result.get('error') or response.get('body')}]"
+    return batch, results
+
+def clear_batch(batch_id):
+    """Cancel a batch that is still running and delete its files"""
+    batch = batch_client.batches.retrieve(batch_id)
+    if batch.status not in BATCH_STOPPED_STATUSES:
+        batch = batch_client.batches.cancel(batch_id)
+        logger.info(f"Cancelled batch: {batch_id}")
+    file_id_list = [
+        file_id for file_id in (batch.input_file_id, batch.output_file_id, batch.error_file_id)
+        if file_id
+    ]
+    asyncio.run_coroutine_threadsafe(delete_resources(None, file_id_list), event_loop).result()
+
+def render_batch_analysis():
+    """Render the bulk questions section"""
+    with st.expander("📦 Bulk Questions (does not use your uploaded files)"):
+        st.markdown(
+            "Submit many general questions at once for offline processing at a lower cost. "
+            "These are answered by the model alone: your uploaded files and the code interpreter are **not** used. "
+            "Results may take up to 24 hours."
+        )
+        
+        if not ss.batch_id:
+            questions = st.text_area("Questions (one per line)")
+            if st.button("Submit Bulk Analysis") and questions.strip():
+                requests = [
+                    {"custom_id": f"question-{index}", "question": question.strip()}
+                    for index, question in enumerate(questions.splitlines())
+                    if question.strip()
+                ]
+                
+                # Check moderation, rejecting the submission if any question is flagged
+                flagged = [request for request in requests if moderation_endpoint(request["question"])]
+                for request in flagged:
+                    st.error(f"⚠️ This question has been flagged. Please remove or rephrase it: {request['question']}")
+                if flagged:
+                    return
+                
+                try:
+                    batch = batch_analyze_data(requests)
+                    ss.batch_id = batch.id
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error submitting bulk analysis: {e}")
+                    logger.error(f"Error submitting bulk analysis: {e}")
+            return
+        
+        st.info(f"Bulk analysis submitted: {ss.batch_id}")
+        if st.button("Check Bulk Analysis Status"):
+            try:
+                batch, results = retrieve_batch_results(ss.batch_id)
+                st.markdown(f"**Status:** {batch.status}")
+                if batch.errors and batch.errors.data:
+                    for error in batch.errors.data:
+                        st.error(f"Bulk analysis error: {error.message}")
+                for custom_id, answer in results.items():
+                    st.markdown(f"**{custom_id}**")
+                    st.markdown(answer)
+            except Exception as e:
+                st.error(f"Error retrieving bulk analysis: {e}")
+                logger.error(f"Error retrieving bulk analysis: {e}")
+        
+        # Allow a new submission, e.g. after the batch failed, expired or was cancelled
+        if st.button("Clear Bulk Analysis"):
+            try:
+                clear_batch(ss.batch_id)
+            except Exception as e:
+                logger.error(f"Error clearing bulk analysis {ss.batch_id}: {e}")
+            ss.batch_id = None
+            st.rerun()
+
 # Tool handling
 def handle_requires_action(tool_request):
     st.toast("Running data analysis...", icon="📊")
@@ -182,31 +437,72 @@ def handle_requires_action(tool_request):
     
     for tool in data.required_action.submit_tool_outputs.tool_calls:
         if tool.function.arguments:
-            function_arguments = json.loads(tool.function.arguments)
+            function_arguments = orjson.loads(tool.function.arguments)
         else:
             function_arguments = {}
             
-        match tool.function.name:
-            case "analyze_data":
-                logger.info("Calling analyze_data function")
-                answer = analyze_data(**function_arguments)
-                tool_outputs.append({"tool_call_id": tool.id, "output": answer})
-            case _:
-                logger.error(f"Unrecognized function name: {tool.function.name}. Tool: {tool}")
-                ret_val = {
-                    "status": "error",
-                    "message": f"Function name is not recognized. Please check your request structure."
-                }
-                tool_outputs.append({"tool_call_id": tool.id, "output": json.dumps(ret_val)})
+        handler = TOOL_HANDLERS.get(tool.function.name)
+        if handler:
+            logger.info(f"Calling {tool.function.name} function")
+            answer = handler(**function_arguments)
+            tool_outputs.append({"tool_call_id": tool.id, "output": answer})
+        else:
+            logger.error(f"Unrecognized function name: {tool.function.name}. Tool: {tool}")
+            ret_val = {
+                "status": "error",
+                "message": f"Function name is not recognized. Please check your request structure."
+            }
+            tool_outputs.append({"tool_call_id": tool.id, "output": orjson.dumps(ret_val).decode()})
                 
     st.toast("Analysis complete", icon="✅")
     return tool_outputs, data.thread_id, data.id
 
 # Streaming functions
+STREAM_END = object()  # Sentinel marking the end of a stream
+
+async def pump_stream(open_stream, events):
+    """Push events from an async assistant stream onto a queue"""
+    try:
+        async with open_stream() as stream:
+            async for event in stream:
+                events.put(event)
+    except Exception as e:
+        events.put(e)
+    finally:
+        events.put(STREAM_END)
+
+def stream_events(open_stream):
+    """Drive an async assistant stream on the event loop and yield its events"""
+    events = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(pump_stream(open_stream, events), event_loop)
+    try:
+        while (event := events.get()) is not STREAM_END:
+            if isinstance(event, Exception):
+                raise event
+            yield event
+    finally:
+        # Close the HTTP stream if the consumer stops early, e.g. on a rerun or requires_action
+        future.cancel()
+
 def data_streamer():
     """Stream data from the assistant"""
     logger.info(f"Starting data streamer on {ss.stream}")
     st.toast("Analyzing data...", icon="🔍")
+    
+    # Images are downloaded in the background while text keeps streaming
+    pending_images = []
+    yield from stream_content(pending_images)
+    for image_future in pending_images:
+        from PIL import Image
+        try:
+            yield Image.open(io.BytesIO(image_future.result()))
+        except Exception as e:
+            logger.error(f"Error downloading image: {e}")
+    
+    logger.info(f"Finished data streamer on {ss.stream}")
+
+def stream_content(pending_images):
+    """Yield streamed text and queue image downloads in pending_images"""
     content_produced = False
     
     for response in ss.stream:
@@ -220,16 +516,20 @@ def data_streamer():
                         yield value
                     case "image_file":
                         logger.info(f"Image file: {content}")
-                        image_content = io.BytesIO(client.files.content(content.image_file.file_id).read())
+                        pending_images.append(image_pool.submit(get_file_content, content.image_file.file_id))
                         
                         # Save the image for download later
-                        ss.assistant_created_file_ids.append(content.image_file.file_id)
+                        ss.assistant_created_file_ids[content.image_file.file_id] = None
                         
                         content_produced = True
-                        yield Image.open(image_content)
+            case "thread.message.completed":
+                # Track files attached to the assistant's message for download later
+                if response.data.role == "assistant":
+                    for attachment in response.data.attachments or []:
+                        ss.assistant_created_file_ids[attachment.file_id] = None
             case "thread.run.requires_action":
                 logger.info(f"Run requires action: {response}")
-                tool_requests.put(response)
+                tool_requests.append(response)
                 if not content_produced:
                     yield "[Running data analysis...]"
                 return
@@ -239,22 +539,32 @@ def data_streamer():
                 return
                 
     st.toast("Analysis complete", icon="✅")
-    logger.info(f"Finished data streamer on {ss.stream}")
 
 def add_message_to_state_session(message):
     """Add a message to the session state"""
-    if message and (isinstance(message, str) and len(message) > 0 or not isinstance(message, str)):
+    if not isinstance(message, str):
+        from PIL import Image
+        if isinstance(message, Image.Image):
+            # Store images as PNG bytes, which st.image serves without re-encoding
+            buffer = io.BytesIO()
+            message.save(buffer, format="PNG")
+            message = buffer.getvalue()
+    if message:
         ss.messages.append({"role": "assistant", "content": message})
 
 def display_stream(content_stream, create_context=True):
     """Display the streaming content"""
     ss.stream = content_stream
     
-    if create_context:
-        with st.chat_message("assistant", avatar="📊"):
+    try:
+        if create_context:
+            with st.chat_message("assistant", avatar="📊"):
+                response = st.write_stream(data_streamer)
+        else:
             response = st.write_stream(data_streamer)
-    else:
-        response = st.write_stream(data_streamer)
+    finally:
+        # Stop the underlying stream even if data_streamer returned early or the script was stopped
+        content_stream.close()
         
     if response is not None:
         if isinstance(response, list):
@@ -265,55 +575,21 @@ def display_stream(content_stream, create_context=True):
             # Single message in response
             add_message_to_state_session(response)
 
+def render_chat_history():
+    """Render the chat history"""
+    for message in ss.messages:
+        with st.chat_message(message["role"], avatar="🧑‍💻" if message["role"] == "user" else "📊"):
+            if isinstance(message["content"], str):
+                st.markdown(message["content"])
+            else:
+                # Handle non-text content like images
+                st.image(message["content"])
+
 # Main application
 def main():
     st.title("📊 Data Analysis Assistant")
     st.markdown("Upload your dataset and ask questions to analyze it.")
     
-    # Initialize or retrieve the assistant
-    if "assistant" not in ss:
-        try:
-            # Try to retrieve existing assistant
-            assistant_id = os.environ.get("AZURE_ASSISTANT_ID", AZURE_ASSISTANT_ID_FALLBACK)
-            assistant = client.beta.assistants.retrieve(assistant_id=assistant_id)
-            logger.info(f"Located assistant: {assistant.name}")
-        except Exception as e:
-            logger.info(f"Creating new assistant: {e}")
-            # Create a new assistant if not found
-            deployment_name = os.environ.get("AZURE_DEPLOYMENT_NAME", AZURE_DEPLOYMENT_NAME_FALLBACK)
-            assistant = client.beta.assistants.create(
-                name="Data Analysis Assistant",
-                instructions="""You are a data analysis assistant. Your job is to help analyze datasets and answer questions about them.
-                When analyzing data:
-                1. First, explore and understand the dataset structure
-                2. Clean and preprocess the data as needed
-                3. Perform the requested analysis
-                4. Create visualizations when appropriate
-                5. Explain your findings in clear, non-technical language
-                
-                Always be concise and focus on the most important insights.
-                """,
-                tools=[
-                    {"type": "code_interpreter"},
-                    {"type": "function", "function": {
-                        "name": "analyze_data",
-                        "description": "Analyze a dataset based on a specific question",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "dataset_name": {"type": "string"},
-                                "question": {"type": "string"}
-                            },
-                            "required": ["dataset_name", "question"]
-                        }
-                    }}
-                ],
-                model=deployment_name
-            )
-            logger.info(f"Created new assistant: {assistant.id}")
-        ss["assistant"] = assistant
-    assistant = ss["assistant"]
-    
     # File upload section
     if not ss.file_uploaded:
         with st.container():
@@ -328,17 +604,17 @@ def main():
                 ss.file_ids = []
                 
                 with st.spinner("Uploading files..."):
-                    for file in uploaded_files:
-                        try:
-                            oai_file = client.files.create(
-                                file=file,
-                                purpose='assistants'
-                            )
-                            ss.file_ids.append(oai_file.id)
-                            logger.info(f"Uploaded file: {file.name} with ID: {oai_file.id}")
-                        except Exception as e:
-                            st.error(f"Error uploading {file.name}: {e}")
-                            continue
+                    # Upload all files concurrently; Streamlit calls stay on the main thread
+                    with ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS) as executor:
+                        futures = {executor.submit(upload_file, file): file for file in uploaded_files}
+                        for future in as_completed(futures):
+                            file = futures[future]
+                            try:
+                                oai_file = future.result()
+                                ss.file_ids.append(oai_file.id)
+                                logger.info(f"Uploaded file: {file.name} with ID: {oai_file.id}")
+                            except Exception as e:
+                                st.error(f"Error uploading {file.name}: {e}")
                 
                 if ss.file_ids:
                     st.success(f"✅ Successfully uploaded {len(ss.file_ids)} file(s)")
@@ -365,13 +641,7 @@ def main():
             )
         
         # Display chat history
-        for message in ss.messages:
-            with st.chat_message(message["role"], avatar="🧑‍💻" if message["role"] == "user" else "📊"):
-                if isinstance(message["content"], str):
-                    st.markdown(message["content"])
-                else:
-                    # Handle non-text content like images
-                    st.image(message["content"])
+        render_chat_history()
         
         # Question input
         question = st.chat_input("Ask a question about your data...")
@@ -396,52 +666,50 @@ def main():
                 content=question
             )
             
-            # Run the assistant
-            with client.beta.threads.runs.stream(
+            # Run the assistant and display streaming response
+            display_stream(stream_events(partial(
+                async_client.beta.threads.runs.stream,
                 thread_id=ss.thread_id,
                 assistant_id=assistant.id,
-            ) as stream:
-                # Display streaming response
-                display_stream(stream)
-                
-                # Handle tool calls
-                while not tool_requests.empty():
-                    logger.info("Handling tool requests")
-                    with st.chat_message("assistant", avatar="📊"):
-                        tool_outputs, thread_id, run_id = handle_requires_action(tool_requests.get())
-                        with client.beta.threads.runs.submit_tool_outputs_stream(
-                            thread_id=thread_id,
-                            run_id=run_id,
-                            tool_outputs=tool_outputs
-                        ) as tool_stream:
-                            display_stream(tool_stream, create_context=False)
+            )))
             
-            # Get files created by the assistant
-            ss.assistant_created_file_ids = retrieve_assistant_created_files(ss.thread_id)
+            # Handle tool calls
+            while tool_requests:
+                logger.info("Handling tool requests")
+                with st.chat_message("assistant", avatar="📊"):
+                    tool_outputs, thread_id, run_id = handle_requires_action(tool_requests.popleft())
+                    display_stream(stream_events(partial(
+                        async_client.beta.threads.runs.submit_tool_outputs_stream,
+                        thread_id=thread_id,
+                        run_id=run_id,
+                        tool_outputs=tool_outputs
+                    )), create_context=False)
             
             # Render download buttons for generated files
             if ss.assistant_created_file_ids:
-                render_download_files(ss.assistant_created_file_ids)
+                render_download_files(list(ss.assistant_created_file_ids))
         
         # Reset button
         if st.button("Start New Analysis", type="secondary"):
-            # Clean up
-            if ss.thread_id:
-                delete_thread(ss.thread_id)
-            if ss.file_ids:
-                delete_files(ss.file_ids)
-            if ss.assistant_created_file_ids:
-                delete_files(ss.assistant_created_file_ids)
+            # Clean up the thread and all files in parallel
+            asyncio.run_coroutine_threadsafe(
+                delete_resources(ss.thread_id, ss.file_ids + list(ss.assistant_created_file_ids)),
+                event_loop
+            ).result()
             
             # Reset session state
             ss.file_uploaded = False
             ss.messages = []
             ss.thread_id = None
             ss.file_ids = []
-            ss.assistant_created_file_ids = []
+            ss.assistant_created_file_ids = {}
             
             st.rerun()
 
 # Run the app
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
+    
+    # Bulk questions section, independent of the uploaded files and the chat flow
+    st.divider()
+    render_batch_analysis()
\ No newline at end of file